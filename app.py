@@ -1,12 +1,13 @@
 import streamlit as st
 import boto3
-import requests
-import json
-from PIL import Image
-import fitz  # PyMuPDF for PDF handling
-import io
-from botocore.exceptions import ClientError
-import base64
+import re
+import string
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Heavy imports (PyMuPDF, aiohttp, requests) are deferred to the functions
+# that need them so the app's first paint is not delayed by C extensions
+# the user may never exercise
 
 # Page config
 st.set_page_config(
@@ -25,155 +26,232 @@ if 'enhanced_data' not in st.session_state:
     st.session_state.enhanced_data = None
 if 'selected_file' not in st.session_state:
     st.session_state.selected_file = None
+if 'batch_results' not in st.session_state:
+    st.session_state.batch_results = {}
 
 @st.cache_resource
 def get_s3_client():
     """Initialize S3 client"""
     return boto3.client('s3')
 
+# Boundary characters that split large listings into contiguous key
+# ranges; the choice only spreads the work, completeness never depends
+# on what a filename starts with
+_RANGE_BOUNDARIES = sorted(string.digits + string.ascii_letters + "._-")
+
+def _collect_files(page):
+    """Convert one list_objects_v2 page into file dicts"""
+    files = []
+    for obj in page.get('Contents', ()):
+        key = obj['Key']
+        if key.endswith('/'):  # Skip folder placeholders
+            continue
+        files.append({
+            'key': key,
+            'name': key.rsplit('/', 1)[-1],
+            'size': obj['Size'],
+            'modified': obj['LastModified']
+        })
+    return files
+
+def _list_key_range(start_after, stop_at):
+    """Paginate keys in (start_after, stop_at], or to the end if stop_at is empty"""
+    s3_client = get_s3_client()
+    paginator = s3_client.get_paginator('list_objects_v2')
+
+    kwargs = {
+        'Bucket': S3_BUCKET,
+        'Prefix': f"{S3_FOLDER}/",
+        'PaginationConfig': {'PageSize': 1000}
+    }
+    if start_after:
+        kwargs['StartAfter'] = start_after
+
+    files = []
+    for page in paginator.paginate(**kwargs):
+        page_files = _collect_files(page)
+        if stop_at:
+            page_files = [f for f in page_files if f['key'] <= stop_at]
+        files.extend(page_files)
+
+        # Keys arrive in order, so stop paging once the range is exhausted
+        contents = page.get('Contents') or []
+        if stop_at and contents and contents[-1]['Key'] > stop_at:
+            break
+    return files
+
 @st.cache_data(ttl=300)
 def list_s3_files():
     """List files in S3 pytextract folder"""
     try:
         s3_client = get_s3_client()
+
+        # Fast path: most folders fit in a single page
         response = s3_client.list_objects_v2(
             Bucket=S3_BUCKET,
-            Prefix=f"{S3_FOLDER}/"
+            Prefix=f"{S3_FOLDER}/",
+            MaxKeys=1000
         )
-        
-        files = []
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                key = obj['Key']
-                if key != f"{S3_FOLDER}/":  # Skip folder itself
-                    files.append({
-                        'key': key,
-                        'name': key.split('/')[-1],
-                        'size': obj['Size'],
-                        'modified': obj['LastModified']
-                    })
+        if not response.get('IsTruncated'):
+            return _collect_files(response)
+
+        # Large folder: fan out one paginator per contiguous key range so
+        # every key lands in exactly one shard, including names that start
+        # outside the boundary set (the shared boto3 client is thread-safe)
+        boundaries = [f"{S3_FOLDER}/{c}" for c in _RANGE_BOUNDARIES]
+        ranges = zip([''] + boundaries, boundaries + [''])
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            futures = [executor.submit(_list_key_range, lo, hi) for lo, hi in ranges]
+            files = []
+            for future in futures:
+                files.extend(future.result())
+
+        files.sort(key=lambda f: f['key'])
         return files
     except Exception as e:
         st.error(f"Error listing S3 files: {str(e)}")
         return []
 
+@st.cache_data(ttl=60, show_spinner=False)
+def _head_etag(key):
+    """Get the current ETag for an S3 object"""
+    s3_client = get_s3_client()
+    return s3_client.head_object(Bucket=S3_BUCKET, Key=key)['ETag']
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _get_object_bytes(key, etag):
+    """Download an S3 object, cached per (key, etag) so stale bytes are never served"""
+    s3_client = get_s3_client()
+    return s3_client.get_object(Bucket=S3_BUCKET, Key=key)['Body'].read()
+
 def download_s3_file(key):
     """Download file from S3"""
     try:
-        s3_client = get_s3_client()
-        response = s3_client.get_object(Bucket=S3_BUCKET, Key=key)
-        return response['Body'].read()
+        return _get_object_bytes(key, _head_etag(key))
     except Exception as e:
         st.error(f"Error downloading file: {str(e)}")
         return None
 
-def call_enhancement_api(bucket, key):
-    """Call the Lambda API for text enhancement"""
-    try:
-        payload = {
-            "bucket": bucket,
-            "key": key
-        }
-        
-        with st.spinner("Processing document..."):
-            response = requests.post(
+@st.cache_resource
+def _http():
+    """Shared requests session so repeated calls reuse one TLS connection"""
+    import requests
+
+    session = requests.Session()
+    session.mount('https://', requests.adapters.HTTPAdapter(
+        pool_connections=4, pool_maxsize=8))
+    return session
+
+def _poll_textract_job(bucket, key, job_id, max_wait=300):
+    """Poll the API until an async Textract job finishes"""
+    deadline = time.monotonic() + max_wait
+    payload = {"bucket": bucket, "key": key, "jobId": job_id}
+
+    while time.monotonic() < deadline:
+        time.sleep(2)
+        try:
+            response = _http().post(
                 LAMBDA_API_URL,
                 headers={"Content-Type": "application/json"},
                 json=payload,
                 timeout=60
             )
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            st.error(f"API Error: {response.status_code} - {response.text}")
-            return None
-            
-    except requests.exceptions.Timeout:
-        st.error("Request timed out. The document might be too large or complex.")
-        return None
+        except Exception as e:
+            return {'error': f"Error polling job: {str(e)}"}
+
+        if response.status_code != 200:
+            return {'error': f"API Error: {response.status_code} - {response.text}"}
+
+        result = response.json()
+        if result.get('status') != 'IN_PROGRESS':
+            return result
+
+    return {'error': f"Textract job {job_id} timed out after {max_wait}s"}
+
+def call_enhancement_api(bucket, keys):
+    """Call the Lambda API for text enhancement on one or more documents"""
+    try:
+        from async_api import call_enhancement_api_batch
+
+        payloads = [{"bucket": bucket, "key": key} for key in keys]
+
+        with st.spinner(f"Processing {len(payloads)} document(s)..."):
+            results = call_enhancement_api_batch(LAMBDA_API_URL, payloads)
+
+        # PDFs come back as async Textract jobs that need polling
+        pending = [i for i, r in enumerate(results)
+                   if isinstance(r, dict) and r.get('jobId')]
+        if pending:
+            status = st.empty()
+            for i in pending:
+                status.info(f"Waiting for OCR of {keys[i].split('/')[-1]}...")
+                results[i] = _poll_textract_job(bucket, keys[i], results[i]['jobId'])
+            status.empty()
+
+        for result in results:
+            if isinstance(result, dict) and result.get('error'):
+                st.error(result['error'])
+
+        return results
+
     except Exception as e:
         st.error(f"Error calling API: {str(e)}")
         return None
 
+@st.cache_data(show_spinner=False)
 def display_pdf(file_data):
-    """Display PDF using PyMuPDF"""
+    """Render the first PDF page with PyMuPDF, cached per file bytes"""
     try:
+        import fitz  # PyMuPDF for PDF handling
+
         pdf_document = fitz.open(stream=file_data, filetype="pdf")
-        
+
         # Convert first page to image for display
         page = pdf_document[0]
         mat = fitz.Matrix(2, 2)  # Scale factor for better quality
-        pix = page.get_pixmap(matrix=mat)
-        img_data = pix.tobytes("png")
-        
+        pix = page.get_pixmap(matrix=mat, alpha=False)
+
+        # st.image takes encoded bytes directly, so no PIL decode is needed;
+        # the cache means the PNG encode runs once per document
+        png_bytes = pix.tobytes("png")
+
         pdf_document.close()
-        
-        image = Image.open(io.BytesIO(img_data))
-        return image
-        
+        return png_bytes
+
     except Exception as e:
         st.error(f"Error displaying PDF: {str(e)}")
         return None
 
-def display_image(file_data):
-    """Display image file"""
-    try:
-        image = Image.open(io.BytesIO(file_data))
-        return image
-    except Exception as e:
-        st.error(f"Error displaying image: {str(e)}")
-        return None
+# Collapse blank lines and surrounding whitespace in one C-level regex pass
+_WS_LINES = re.compile(r'[ \t]*\n[ \t]*(?:\n[ \t]*)*')
+_EDGE_WS = re.compile(r'^\s+|\s+$')
 
 def format_enhanced_text(text):
     """Format enhanced text for better display"""
     if not text:
         return "No text detected"
-    
-    # Split by lines and format
-    lines = text.split('\n')
-    formatted_lines = []
-    
-    for line in lines:
-        line = line.strip()
-        if line:
-            formatted_lines.append(line)
-    
-    return '\n'.join(formatted_lines)
+
+    return _EDGE_WS.sub('', _WS_LINES.sub('\n', text))
 
 def display_changes(changes):
-    """Display changes in a formatted way"""
+    """Display changes as a single Arrow-backed dataframe"""
     if not changes:
         st.info("No changes were made to the text")
         return
-    
+
+    import pandas as pd
+
     st.subheader("Changes Made:")
-    
-    for i, change in enumerate(changes, 1):
-        col1, col2, col3 = st.columns([2, 2, 1])
-        
-        with col1:
-            st.text(f"Original: {change.get('original', 'N/A')}")
-        
-        with col2:
-            st.text(f"Corrected: {change.get('corrected', 'N/A')}")
-        
-        with col3:
-            change_type = change.get('type', 'unknown')
-            if change_type == 'spelling':
-                st.success("Spelling")
-            elif change_type == 'ocr_error':
-                st.warning("OCR Error")
-            elif change_type == 'formatting':
-                st.info("Formatting")
-            else:
-                st.text(change_type.title())
-        
-        if i < len(changes):
-            st.divider()
+
+    # One dataframe payload replaces four widget messages per change,
+    # and rendering stays client-side even for long documents
+    df = pd.DataFrame(changes, columns=['original', 'corrected', 'type'])
+    df['type'] = df['type'].fillna('unknown').str.replace('_', ' ').str.title()
+    st.dataframe(df, use_container_width=True, hide_index=True)
 
 # Main app
 def main():
+    _inject_css()
     st.title("📄 OCR Text Enhancement Tool")
     st.markdown("---")
     
@@ -208,13 +286,34 @@ def main():
         st.text(f"Name: {selected_file['name']}")
         st.text(f"Size: {selected_file['size']} bytes")
         st.text(f"Modified: {selected_file['modified'].strftime('%Y-%m-%d %H:%M')}")
-        
+
+        # Optional multi-document selection for batch enhancement
+        batch_keys = st.multiselect(
+            "Enhance multiple documents:",
+            [f['key'] for f in files],
+            default=[selected_file['key']],
+            format_func=lambda k: k.split('/')[-1]
+        )
+
         # Enhance button
         if st.button("✨ Enhance Text", type="primary", use_container_width=True):
-            result = call_enhancement_api(S3_BUCKET, selected_file['key'])
-            if result:
-                st.session_state.enhanced_data = result
-                st.success("Enhancement completed!")
+            keys = batch_keys or [selected_file['key']]
+            results = call_enhancement_api(S3_BUCKET, keys)
+            if results:
+                # Keep only successful results; errors were already shown
+                succeeded = {key: result for key, result in zip(keys, results)
+                             if isinstance(result, dict) and not result.get('error')}
+                st.session_state.batch_results.update(succeeded)
+                if selected_file['key'] in succeeded:
+                    st.session_state.enhanced_data = succeeded[selected_file['key']]
+                if succeeded:
+                    st.success(
+                        f"Enhancement completed for {len(succeeded)} of "
+                        f"{len(keys)} document(s)!")
+
+        # Show cached batch result when switching documents
+        if selected_file['key'] in st.session_state.batch_results:
+            st.session_state.enhanced_data = st.session_state.batch_results[selected_file['key']]
     
     # Main content area
     if st.session_state.selected_file:
@@ -228,18 +327,18 @@ def main():
             with col1:
                 st.subheader("📄 Original Document")
                 
-                file_name = st.session_state.selected_file.lower()
-                
-                if file_name.endswith('.pdf'):
-                    image = display_pdf(file_data)
-                    if image:
-                        st.image(image, use_column_width=True)
-                
-                elif file_name.endswith(('.jpg', '.jpeg', '.png')):
-                    image = display_image(file_data)
-                    if image:
-                        st.image(image, use_column_width=True)
-                
+                # Dispatch on magic bytes so extensionless files still preview
+                sig = file_data[:4]
+
+                if sig == b'%PDF':
+                    preview = display_pdf(file_data)
+                    if preview:
+                        st.image(preview, use_column_width=True)
+
+                elif sig[:3] == b'\xff\xd8\xff' or sig == b'\x89PNG':
+                    # st.image embeds JPEG/PNG bytes as-is - no decode needed
+                    st.image(file_data, use_column_width=True)
+
                 else:
                     st.warning("Unsupported file format for preview")
             
@@ -297,8 +396,11 @@ def main():
     else:
         st.info("Please select a document from the sidebar to get started.")
 
-# Custom CSS for better styling
-st.markdown("""
+# Custom CSS for better styling; cached so the style block is only
+# injected once per process instead of re-sent on every rerun
+@st.cache_resource
+def _inject_css():
+    st.markdown("""
 <style>
     .stButton > button {
         width: 100%;
@@ -325,6 +427,7 @@ st.markdown("""
     }
 </style>
 """, unsafe_allow_html=True)
+    return True
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
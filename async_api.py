@@ -0,0 +1,37 @@
+import asyncio
+
+import aiohttp
+
+
+async def _post_one(session, url, payload):
+    """POST a single enhancement payload and return the parsed JSON response"""
+    try:
+        async with session.post(
+            url,
+            headers={"Content-Type": "application/json"},
+            json=payload,
+            timeout=aiohttp.ClientTimeout(total=60)
+        ) as response:
+            if response.status == 200:
+                return await response.json()
+            error_text = await response.text()
+            return {'error': f"API Error: {response.status} - {error_text}"}
+
+    except asyncio.TimeoutError:
+        return {'error': 'Request timed out. The document might be too large or complex.'}
+    except aiohttp.ClientError as e:
+        return {'error': f"Error calling API: {str(e)}"}
+
+
+async def post_many(url, payloads):
+    """POST all payloads concurrently over a single connection pool"""
+    connector = aiohttp.TCPConnector(limit=32)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        return await asyncio.gather(
+            *[_post_one(session, url, payload) for payload in payloads]
+        )
+
+
+def call_enhancement_api_batch(url, payloads):
+    """Sync entry point for Streamlit - run the async fan-out to completion"""
+    return asyncio.run(post_many(url, payloads))
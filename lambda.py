@@ -1,11 +1,213 @@
+import asyncio
 import json
 import boto3
 import os
 from botocore.exceptions import ClientError
 from urllib.parse import unquote_plus
 
+# Use orjson when available (packaged via a Lambda layer); its
+# JSONDecodeError subclasses json.JSONDecodeError, so the existing
+# error handling works with either serializer
+try:
+    import orjson
+
+    def jdumps(obj):
+        return orjson.dumps(obj).decode()
+
+    jloads = orjson.loads
+except ImportError:
+    jdumps = json.dumps
+    jloads = json.loads
+
 # Hardcoded configurations
 MODEL_ID = "us.deepseek.r1-v1:0"  # Cross-region inference profile for DeepSeek R1
+CACHE_PREFIX = "pytextract-cache"  # S3 prefix for ETag-keyed OCR/enhancement caches
+
+# Enhancement prompt, split around the per-document OCR text so the
+# invariant boilerplate is built once at import time
+_PROMPT_PREFIX = """You are a text enhancement specialist for OCR-extracted content.
+
+Your task is to:
+- Fix spelling mistakes and OCR errors in the provided text
+- Correct common OCR misreads (like 'rn' instead of 'm', '0' instead of 'O', etc.)
+- Improve text formatting and readability
+- Maintain the original meaning and structure
+- Be conservative - only fix obvious errors
+- Preserve names, addresses, and numbers as accurately as possible
+
+Focus on:
+- Spelling corrections for common words
+- OCR character recognition errors
+- Proper capitalization
+- Basic punctuation fixes
+- Removing extra spaces or line breaks where appropriate
+
+Please enhance and correct the following OCR-extracted text. Fix spelling mistakes and OCR errors while preserving the original meaning and structure:
+
+ORIGINAL OCR TEXT:
+"""
+
+_PROMPT_SUFFIX = """
+Please return your response as a JSON object with the following structure:
+{
+    "enhanced_text": "corrected and enhanced version of the text",
+    "changes_made": [
+        {
+            "original": "original text/word",
+            "corrected": "corrected text/word",
+            "type": "spelling|ocr_error|formatting|punctuation"
+        }
+    ],
+    "summary": "Brief summary of improvements made"
+}
+
+Only return the JSON object, no additional text."""
+
+# Batch variant: several OCR segments enhanced in one model call
+_BATCH_PROMPT_PREFIX = """You are a text enhancement specialist for OCR-extracted content.
+
+Enhance each of the following OCR segments: fix spelling mistakes, OCR
+misreads, capitalization, and basic punctuation while preserving the
+original meaning and structure. Be conservative - only fix obvious errors.
+
+"""
+
+_BATCH_PROMPT_SUFFIX = """
+
+Return your response as a JSON array with one object per segment, in order:
+[
+    {
+        "enhanced_text": "corrected and enhanced version of the segment",
+        "changes_made": [
+            {
+                "original": "original text/word",
+                "corrected": "corrected text/word",
+                "type": "spelling|ocr_error|formatting|punctuation"
+            }
+        ],
+        "summary": "Brief summary of improvements made"
+    }
+]
+
+Only return the JSON array, no additional text."""
+
+# Static portion of the Bedrock request body, reused on every call
+_INVOKE_PARAMS = {
+    "max_tokens": 2000,
+    "temperature": 0.1,  # Low temperature for accuracy
+    "top_p": 0.9
+}
+
+# Clients are built once per container so warm invocations skip the
+# ~100ms of service-model parsing and endpoint setup per client
+_SESSION = boto3.session.Session()
+TEXTRACT = _SESSION.client('textract')
+BEDROCK = _SESSION.client('bedrock-runtime')
+S3 = _SESSION.client('s3')
+
+def get_cached_object(s3_client, bucket, key):
+    """Fetch a cache object from S3, returning None on a cache miss
+
+    The cache is best-effort: a missing key surfaces as NoSuchKey (or
+    403 AccessDenied when the role lacks s3:ListBucket), and any other
+    failure is logged rather than failing the whole request.
+    """
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        return response['Body'].read()
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404', 'AccessDenied', '403'):
+            print(f"Cache read failed for s3://{bucket}/{key}: {str(e)}")
+        return None
+
+def put_cached_object(s3_client, bucket, key, body, content_type):
+    """Store a cache object in S3, ignoring failures (cache is best-effort)"""
+    try:
+        s3_client.put_object(Bucket=bucket, Key=key, Body=body, ContentType=content_type)
+    except ClientError as e:
+        print(f"Cache write failed for s3://{bucket}/{key}: {str(e)}")
+
+async def _fetch_caches(bucket, ocr_key, enhanced_key):
+    return await asyncio.gather(
+        asyncio.to_thread(get_cached_object, S3, bucket, ocr_key),
+        asyncio.to_thread(get_cached_object, S3, bucket, enhanced_key)
+    )
+
+def fetch_caches(bucket, ocr_key, enhanced_key):
+    """Fetch both cache objects with their S3 round-trips overlapped"""
+    return asyncio.run(_fetch_caches(bucket, ocr_key, enhanced_key))
+
+def collect_stream(event_stream):
+    """Join streamed Bedrock completion chunks into the full response text"""
+    pieces = []
+    for event in event_stream:
+        chunk = jloads(event['chunk']['bytes'])
+        # Chunk shape varies by model family, mirror the fallbacks used
+        # for the non-streaming response formats
+        if 'choices' in chunk:
+            choice = chunk['choices'][0]
+            piece = (choice.get('delta', {}).get('content')
+                     or choice.get('message', {}).get('content', ''))
+        elif 'delta' in chunk:
+            piece = chunk['delta'].get('text', '')
+        elif 'outputText' in chunk:
+            piece = chunk['outputText']
+        else:
+            piece = ''
+        if piece:
+            pieces.append(piece)
+    return ''.join(pieces)
+
+def extract_lines(blocks):
+    """Join Textract LINE blocks into newline-terminated text"""
+    lines = [block['Text'] for block in blocks
+             if block.get('BlockType') == 'LINE' and block.get('Text')]
+    return "\n".join(lines) + "\n" if lines else ""
+
+def enhance_batch(texts):
+    """Enhance several OCR segments with a single Bedrock call
+
+    One round-trip and one model prefill are amortized over all segments
+    instead of paying them once per document.
+    """
+    segments = [f"=== SEGMENT {i} ===\n{text}" for i, text in enumerate(texts, 1)]
+    prompt = _BATCH_PROMPT_PREFIX + "\n\n".join(segments) + _BATCH_PROMPT_SUFFIX
+
+    response = BEDROCK.invoke_model_with_response_stream(
+        modelId=MODEL_ID,
+        contentType='application/json',
+        accept='application/json',
+        body=jdumps({
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            **dict(_INVOKE_PARAMS, max_tokens=min(2000 * len(texts), 8192))
+        })
+    )
+
+    enhancement_analysis = collect_stream(response['body'])
+
+    try:
+        parsed = jloads(enhancement_analysis)
+    except json.JSONDecodeError:
+        parsed = None
+
+    results = []
+    for i, text in enumerate(texts):
+        item = parsed[i] if isinstance(parsed, list) and i < len(parsed) else {}
+        if not isinstance(item, dict):
+            item = {}
+        results.append({
+            'original_text': text.strip(),
+            'enhanced_text': item.get('enhanced_text', text.strip()),
+            'changes_made': item.get('changes_made', []),
+            'summary': item.get('summary', 'Error parsing enhancement response'
+                       if parsed is None else 'No changes made')
+        })
+    return results
 
 def get_response_headers(event):
     """Return appropriate headers based on event type"""
@@ -29,108 +231,200 @@ def lambda_handler(event, context):
             s3_record = event['Records'][0]['s3']
             s3_bucket = s3_record['bucket']['name']
             s3_key = unquote_plus(s3_record['object']['key'])  # URL decode
-            
+            job_id = ''
+
             print(f"S3 Event triggered for: s3://{s3_bucket}/{s3_key}")
         else:
             # Manual API call - extract from body
-            body = json.loads(event.get('body', '{}') if isinstance(event.get('body'), str) else event.get('body', '{}'))
+            body = jloads(event.get('body', '{}') if isinstance(event.get('body'), str) else event.get('body', '{}'))
+            # Batch action: enhance several already-OCRed segments in one
+            # model call
+            if body.get('action') == 'batch':
+                texts = body.get('texts', [])
+                if not texts:
+                    return {
+                        'statusCode': 400,
+                        'headers': get_response_headers(event),
+                        'body': jdumps({'error': 'Missing texts for batch action'})
+                    }
+                return {
+                    'statusCode': 200,
+                    'headers': get_response_headers(event),
+                    'body': jdumps({'results': enhance_batch(texts)})
+                }
+
             s3_bucket = body.get('bucket', '')
             s3_key = body.get('key', '')
-            
+            job_id = body.get('jobId', '')  # Set when polling an async Textract job
+
             if not s3_bucket or not s3_key:
                 return {
                     'statusCode': 400,
                     'headers': get_response_headers(event),
-                    'body': json.dumps({'error': 'Missing bucket or key parameter'})
+                    'body': jdumps({'error': 'Missing bucket or key parameter'})
                 }
         
-        # Initialize AWS clients
-        textract_client = boto3.client('textract')
-        bedrock_runtime = boto3.client('bedrock-runtime')
-        s3_client = boto3.client('s3')
-        
         # First, check if file exists and get metadata
         try:
-            file_info = s3_client.head_object(Bucket=s3_bucket, Key=s3_key)
+            file_info = S3.head_object(Bucket=s3_bucket, Key=s3_key)
             file_size = file_info['ContentLength']
             content_type = file_info.get('ContentType', '')
-            
+
             print(f"File size: {file_size} bytes, Content-Type: {content_type}")
-            
-            # Check file size limit (10MB for detect_document_text)
-            if file_size > 10 * 1024 * 1024:  # 10MB
-                return {
-                    'statusCode': 400,
-                    'headers': get_response_headers(event),
-                    'body': json.dumps({
-                        'error': 'File too large',
-                        'message': f'File size {file_size} bytes exceeds 10MB limit for Textract'
-                    })
-                }
-                
+
         except ClientError as e:
             return {
                 'statusCode': 404,
                 'headers': get_response_headers(event),
-                'body': json.dumps({
+                'body': jdumps({
                     'error': 'File not found',
                     'message': f'Could not access s3://{s3_bucket}/{s3_key}'
                 })
             }
-        
-        # Perform OCR using AWS Textract
+
+        # ETag changes iff the object bytes change, so it makes a
+        # self-invalidating cache key for both OCR and enhancement results
+        etag = file_info['ETag'].strip('"')
+        ocr_cache_key = f"{CACHE_PREFIX}/{etag}.txt"
+        enhanced_cache_key = f"{CACHE_PREFIX}/{etag}.enhanced.json"
+
+        # Both cache lookups depend only on the ETag, so dispatch them
+        # concurrently and save one S3 round-trip
+        cached_text, cached_response = fetch_caches(
+            s3_bucket, ocr_cache_key, enhanced_cache_key)
+
+        # Full cache hit: skip both Textract and Bedrock
+        if cached_response is not None:
+            print(f"Enhancement cache hit for ETag {etag}")
+            return {
+                'statusCode': 200,
+                'headers': get_response_headers(event),
+                'body': cached_response.decode('utf-8')
+            }
+
+        # Perform OCR using AWS Textract (unless cached for this ETag)
         print(f"Processing file: s3://{s3_bucket}/{s3_key}")
-        
-        try:
-            # Use detect_document_text for simple text detection (no tables/forms)
-            textract_response = textract_client.detect_document_text(
-                Document={
+
+        if cached_text is not None:
+            print(f"OCR cache hit for ETag {etag}")
+            extracted_text = cached_text.decode('utf-8')
+        elif job_id:
+            # Client is polling an async Textract job started below
+            job_response = TEXTRACT.get_document_text_detection(JobId=job_id)
+            job_status = job_response['JobStatus']
+
+            if job_status == 'IN_PROGRESS':
+                return {
+                    'statusCode': 200,
+                    'headers': get_response_headers(event),
+                    'body': jdumps({'jobId': job_id, 'status': 'IN_PROGRESS'})
+                }
+
+            # PARTIAL_SUCCESS still returns blocks for the pages that
+            # processed, so treat it like success rather than a hard failure
+            if job_status not in ('SUCCEEDED', 'PARTIAL_SUCCESS'):
+                return {
+                    'statusCode': 500,
+                    'headers': get_response_headers(event),
+                    'body': jdumps({
+                        'error': 'Textract job failed',
+                        'message': job_response.get('StatusMessage', f'Job status: {job_status}')
+                    })
+                }
+
+            # Collect blocks across all result pages
+            blocks = job_response['Blocks']
+            next_token = job_response.get('NextToken')
+            while next_token:
+                job_response = TEXTRACT.get_document_text_detection(
+                    JobId=job_id, NextToken=next_token)
+                blocks.extend(job_response['Blocks'])
+                next_token = job_response.get('NextToken')
+
+            extracted_text = extract_lines(blocks)
+            put_cached_object(S3, s3_bucket, ocr_cache_key,
+                              extracted_text.encode('utf-8'), 'text/plain')
+        elif 'Records' not in event and s3_key.lower().endswith('.pdf'):
+            # PDFs go through async Textract: start the job and return
+            # immediately so the client can poll with the job ID. This also
+            # lifts the single-page/10MB limit of detect_document_text.
+            start_response = TEXTRACT.start_document_text_detection(
+                DocumentLocation={
                     'S3Object': {
                         'Bucket': s3_bucket,
                         'Name': s3_key
                     }
                 }
             )
-        except ClientError as textract_error:
-            error_code = textract_error.response['Error']['Code']
-            error_message = textract_error.response['Error']['Message']
-            
-            print(f"Textract Error: {error_code} - {error_message}")
-            
-            # Try alternative approach for PDFs
-            if error_code == 'UnsupportedDocumentException' and s3_key.lower().endswith('.pdf'):
+            return {
+                'statusCode': 200,
+                'headers': get_response_headers(event),
+                'body': jdumps({
+                    'jobId': start_response['JobId'],
+                    'status': 'IN_PROGRESS'
+                })
+            }
+        else:
+            # Check file size limit (10MB for detect_document_text)
+            if file_size > 10 * 1024 * 1024:  # 10MB
                 return {
                     'statusCode': 400,
                     'headers': get_response_headers(event),
-                    'body': json.dumps({
-                        'error': 'PDF format not supported',
-                        'message': 'Try converting PDF to JPG/PNG format, or ensure PDF is not password protected',
-                        'suggestions': [
-                            'Convert PDF to image format (JPG, PNG)',
-                            'Ensure PDF is not password protected',
-                            'Check if PDF file is corrupted',
-                            'Verify PDF is under 10MB'
-                        ]
+                    'body': jdumps({
+                        'error': 'File too large',
+                        'message': f'File size {file_size} bytes exceeds 10MB limit for Textract'
                     })
                 }
-            else:
-                # Re-raise the original error
-                raise textract_error
-        
-        # Extract text from Textract response
-        extracted_text = ""
-        
-        for block in textract_response['Blocks']:
-            if block['BlockType'] == 'LINE':
-                text = block.get('Text', '')
-                extracted_text += text + "\n"
-        
+
+            try:
+                # Use detect_document_text for simple text detection (no tables/forms)
+                textract_response = TEXTRACT.detect_document_text(
+                    Document={
+                        'S3Object': {
+                            'Bucket': s3_bucket,
+                            'Name': s3_key
+                        }
+                    }
+                )
+            except ClientError as textract_error:
+                error_code = textract_error.response['Error']['Code']
+                error_message = textract_error.response['Error']['Message']
+
+                print(f"Textract Error: {error_code} - {error_message}")
+
+                # Try alternative approach for PDFs
+                if error_code == 'UnsupportedDocumentException' and s3_key.lower().endswith('.pdf'):
+                    return {
+                        'statusCode': 400,
+                        'headers': get_response_headers(event),
+                        'body': jdumps({
+                            'error': 'PDF format not supported',
+                            'message': 'Try converting PDF to JPG/PNG format, or ensure PDF is not password protected',
+                            'suggestions': [
+                                'Convert PDF to image format (JPG, PNG)',
+                                'Ensure PDF is not password protected',
+                                'Check if PDF file is corrupted',
+                                'Verify PDF is under 10MB'
+                            ]
+                        })
+                    }
+                else:
+                    # Re-raise the original error
+                    raise textract_error
+
+            # Extract text from Textract response
+            extracted_text = extract_lines(textract_response['Blocks'])
+
+            # Cache the OCR result for this ETag so repeat enhancements skip Textract
+            put_cached_object(S3, s3_bucket, ocr_cache_key,
+                              extracted_text.encode('utf-8'), 'text/plain')
+
         # If no text extracted, return early
         if not extracted_text.strip():
             return {
                 'statusCode': 200,
                 'headers': get_response_headers(event),
-                'body': json.dumps({
+                'body': jdumps({
                     'original_text': '',
                     'enhanced_text': '',
                     'changes_made': [],
@@ -138,83 +432,33 @@ def lambda_handler(event, context):
                 })
             }
         
-        # Prepare LLM prompt for text enhancement
-        system_prompt = """You are a text enhancement specialist for OCR-extracted content.
+        # Only the OCR text varies per invocation; the prompt boilerplate
+        # is precomputed at module scope
+        combined_prompt = _PROMPT_PREFIX + extracted_text + _PROMPT_SUFFIX
 
-Your task is to:
-- Fix spelling mistakes and OCR errors in the provided text
-- Correct common OCR misreads (like 'rn' instead of 'm', '0' instead of 'O', etc.)
-- Improve text formatting and readability
-- Maintain the original meaning and structure
-- Be conservative - only fix obvious errors
-- Preserve names, addresses, and numbers as accurately as possible
-
-Focus on:
-- Spelling corrections for common words
-- OCR character recognition errors
-- Proper capitalization
-- Basic punctuation fixes
-- Removing extra spaces or line breaks where appropriate"""
-
-        user_prompt = f"""Please enhance and correct the following OCR-extracted text. Fix spelling mistakes and OCR errors while preserving the original meaning and structure:
-
-ORIGINAL OCR TEXT:
-{extracted_text}
-
-Please return your response as a JSON object with the following structure:
-{{
-    "enhanced_text": "corrected and enhanced version of the text",
-    "changes_made": [
-        {{
-            "original": "original text/word",
-            "corrected": "corrected text/word",
-            "type": "spelling|ocr_error|formatting|punctuation"
-        }}
-    ],
-    "summary": "Brief summary of improvements made"
-}}
-
-Only return the JSON object, no additional text."""
-
-        # Combine prompts
-        combined_prompt = f"""{system_prompt}
-
-{user_prompt}"""
-
-        # Call LLM for text enhancement
-        response = bedrock_runtime.invoke_model(
+        # Call LLM for text enhancement, consuming tokens as they stream so
+        # parsing overlaps model decode instead of waiting for the full body
+        response = BEDROCK.invoke_model_with_response_stream(
             modelId=MODEL_ID,
             contentType='application/json',
             accept='application/json',
-            body=json.dumps({
+            body=jdumps({
                 "messages": [
                     {
-                        "role": "user", 
+                        "role": "user",
                         "content": combined_prompt
                     }
                 ],
-                "max_tokens": 2000,
-                "temperature": 0.1,  # Low temperature for accuracy
-                "top_p": 0.9
+                **_INVOKE_PARAMS
             })
         )
-        
-        # Parse the LLM response
-        response_body = json.loads(response['body'].read())
-        
-        # Extract the text enhancement analysis
-        if 'choices' in response_body:
-            enhancement_analysis = response_body['choices'][0]['message']['content']
-        elif 'content' in response_body:
-            enhancement_analysis = response_body['content'][0]['text']
-        elif 'output' in response_body:
-            enhancement_analysis = response_body['output']['message']['content'][0]['text']
-        else:
-            enhancement_analysis = str(response_body)
-        
+
+        # Accumulate the streamed completion
+        enhancement_analysis = collect_stream(response['body'])
+
         # Try to parse enhancement analysis as JSON
         try:
-            enhancement_json = json.loads(enhancement_analysis)
+            enhancement_json = jloads(enhancement_analysis)
             enhanced_text = enhancement_json.get('enhanced_text', extracted_text.strip())
             changes_made = enhancement_json.get('changes_made', [])
             summary = enhancement_json.get('summary', 'No changes made')
@@ -231,11 +475,16 @@ Only return the JSON object, no additional text."""
             'changes_made': changes_made,
             'summary': summary
         }
-        
+
+        # Cache the full enhancement result keyed by the same ETag
+        response_body = jdumps(final_response)
+        put_cached_object(S3, s3_bucket, enhanced_cache_key,
+                          response_body.encode('utf-8'), 'application/json')
+
         return {
             'statusCode': 200,
             'headers': get_response_headers(event),
-            'body': json.dumps(final_response)
+            'body': response_body
         }
         
     except ClientError as e:
@@ -246,7 +495,7 @@ Only return the JSON object, no additional text."""
         return {
             'statusCode': 500,
             'headers': get_response_headers(event),
-            'body': json.dumps({
+            'body': jdumps({
                 'error': f"AWS Service Error: {error_code}",
                 'message': error_message
             })
@@ -257,7 +506,7 @@ Only return the JSON object, no additional text."""
         return {
             'statusCode': 400,
             'headers': get_response_headers(event),
-            'body': json.dumps({
+            'body': jdumps({
                 'error': 'Invalid JSON in request body',
                 'message': str(e)
             })
@@ -268,7 +517,7 @@ Only return the JSON object, no additional text."""
         return {
             'statusCode': 500,
             'headers': get_response_headers(event),
-            'body': json.dumps({
+            'body': jdumps({
                 'error': 'Internal server error',
                 'message': str(e)
             })